@@ -0,0 +1,162 @@
+# coding=utf-8
+from typing import List, Tuple
+import asyncio
+import logging
+import struct
+
+_log = logging.getLogger(__name__)
+
+
+class AsyncRcon:
+    """
+    Minecraft: Java Edition RCON client built on asyncio streams.
+    Commands are run one at a time, the server can't cope with more than one packet in flight
+    """
+    _TYPE_RESPONSE = 0
+    _TYPE_COMMAND = 2
+    _TYPE_LOGIN = 3
+
+    # Smallest possible packet (id, type and two null bytes), and a generous upper bound for sanity checking
+    _MIN_PACKET_LENGTH = 10
+    _MAX_PACKET_LENGTH = 1024 * 1024
+
+    # The server splits long responses into packets of this many characters
+    _MAX_FRAGMENT_LENGTH = 4096
+
+    # How long (in seconds) to wait for the server to answer the login
+    _LOGIN_TIMEOUT: float = 10.0
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._reader_task = None  # type: asyncio.Task
+        self._command_lock = asyncio.Lock()
+        self._next_id = 0
+
+        # Packets read by the reader task, for the command currently holding the lock. None means the connection closed
+        self._responses = asyncio.Queue()  # type: asyncio.Queue
+
+    @classmethod
+    async def connect(cls, host: str, port: int, password: str) -> "AsyncRcon":
+        """
+        Open and log in to an RCON connection
+        :param host: Host address
+        :param port: RCON port
+        :param password: RCON password
+        :return: Connected client
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        rcon = cls(reader, writer)
+        try:
+            try:
+                await asyncio.wait_for(rcon._login(password), cls._LOGIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise ConnectionError("Timed out waiting for the RCON server to answer the login")
+        except BaseException:
+            rcon.close()
+            raise
+
+        rcon._reader_task = asyncio.get_running_loop().create_task(rcon._read_loop())
+        return rcon
+
+    def close(self):
+        """
+        Close the connection. Commands still waiting on a response raise ConnectionError
+        :return: None
+        """
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._writer.close()
+
+    def is_open(self) -> bool:
+        """
+        :return: Whether the connection is logged in and still being read from
+        """
+        return self._reader_task is not None and not self._reader_task.done()
+
+    async def command(self, command: str) -> str:
+        """
+        Run a command
+        :param command: command to send to Minecraft
+        :return: String response
+        """
+        # The vanilla server reads each packet with a single socket read, and drops the connection if that read picks
+        # up part of the next packet. So the whole exchange is done under the lock, with one packet in flight at a time
+        async with self._command_lock:
+            if not self.is_open():
+                raise ConnectionError("RCON connection is closed")
+
+            request_id = self._send(self._TYPE_COMMAND, command)
+            await self._writer.drain()
+
+            fragments = []  # type: List[str]
+            end_id = None
+            while True:
+                packet = await self._responses.get()
+                if packet is None:
+                    raise ConnectionError("RCON connection is closed")
+
+                packet_id, _, body = packet
+                if packet_id == request_id:
+                    fragments.append(body)
+                    if end_id is None:
+                        if len(body) < self._MAX_FRAGMENT_LENGTH:
+                            break
+
+                        # A full packet may be followed by more. The server handles requests in order, so the reply
+                        # to this (invalid) request tells us the response to the command is complete
+                        end_id = self._send(self._TYPE_RESPONSE, "")
+                        await self._writer.drain()
+
+                elif packet_id == end_id:
+                    break
+
+                # Anything else is left over from a cancelled command
+
+            return "".join(fragments)
+
+    async def _login(self, password: str):
+        self._send(self._TYPE_LOGIN, password)
+        await self._writer.drain()
+
+        # Some servers send an empty response ahead of the login result, so wait for the result itself
+        while True:
+            request_id, packet_type, _ = await self._read_packet()
+            if packet_type == self._TYPE_COMMAND:
+                break
+
+        if request_id == -1:
+            raise ConnectionError("Incorrect rcon password")
+
+    def _send(self, packet_type: int, body: str) -> int:
+        self._next_id += 1
+        request_id = self._next_id
+
+        payload = struct.pack("<ii", request_id, packet_type) + body.encode("utf8") + b"\x00\x00"
+        self._writer.write(struct.pack("<i", len(payload)) + payload)
+        return request_id
+
+    async def _read_packet(self) -> Tuple[int, int, str]:
+        length, = struct.unpack("<i", await self._reader.readexactly(4))
+        if not self._MIN_PACKET_LENGTH <= length <= self._MAX_PACKET_LENGTH:
+            raise ValueError(f"Malformed RCON packet with length {length}")
+
+        payload = await self._reader.readexactly(length)
+        request_id, packet_type = struct.unpack("<ii", payload[:8])
+        return request_id, packet_type, payload[8:-2].decode("utf8", errors="replace")
+
+    async def _read_loop(self):
+        try:
+            while True:
+                self._responses.put_nowait(await self._read_packet())
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            print("[!] Lost connection to the Minecraft RCON server")
+
+        except Exception:
+            _log.exception("Failed to read from the Minecraft RCON server, closing the connection")
+
+        finally:
+            # Nothing reconnects, so don't leave the dead transport open
+            self._writer.close()
+            self._responses.put_nowait(None)
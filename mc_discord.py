@@ -1,11 +1,15 @@
 # coding=utf-8
 from __future__ import print_function
-from typing import List, Dict, Tuple, Callable
-import mcrcon
-import socket
+from typing import List, Dict, Set, Tuple, Callable
+import asyncio
 import discord
+from async_rcon import AsyncRcon
+from collections import OrderedDict
 from enum import Enum
-import traceback
+import logging
+import time
+
+_log = logging.getLogger(__name__)
 
 
 class Permission(Enum):
@@ -17,21 +21,19 @@ class Permission(Enum):
     Admin = 50
     Owner = 900
 
-    def __lt__(self, other):
-        if self.__class__ is other.__class__:
-            return self.value < other.value
-        return NotImplemented
 
-    def __le__(self, other):
-        if self.__class__ is other.__class__:
-            return self.value <= other.value
-        return NotImplemented
+class CommandUserError(Exception):
+    """
+    Raised by commands when the user gave bad input. The message is sent back to the user as-is
+    """
 
 
 class Command:
     """
     Command struct
     """
+    __slots__ = ("name", "permission", "func", "help")
+
     name: str
     permission: Permission
     func: Callable
@@ -50,35 +52,42 @@ class MCLink:
     """
     _DEBUG: bool = False
 
-    # RCON socket
-    _rcon_socket = None  # type: socket
+    # How long (in seconds) a member's computed permission level is reused for
+    _PERMISSION_CACHE_TTL: float = 60.0
+    # Most members whose permission level is cached at once
+    _PERMISSION_CACHE_SIZE: int = 10000
+
+    # RCON
+    _rcon = None  # type: AsyncRcon
+    _rcon_host = None  # type: str
+    _rcon_port = None  # type: int
+    _rcon_password = None  # type: str
 
     # Discord
     _link = None  # type: _DiscordLink
     _guild_id = None  # type: int
 
-    """
-    List of admins
-    """
-    _bot_admins = []  # type: List[int]
-    _commands = {}  # type: Dict[str, Command]
-    _role_permissions = {}  # type: Dict[int, Permission]
-    _output_channels = {}
-
     class _DiscordLink(discord.Client):
         """
         Custom Discord Client
         """
         _parent: "MCLink"
         _DEBUG: bool = False
+        _PRESENCE = discord.Game("Minecraft: Java Edition")
 
         def __init__(self, parent: "MCLink", *args, **kwargs):
+            # Members are needed in the cache for permission lookups, and message content to read commands
+            intents = discord.Intents.default()
+            intents.members = True
+            intents.message_content = True
+            kwargs.setdefault("intents", intents)
+
             super().__init__(*args, **kwargs)
             self._parent = parent
 
         async def on_ready(self):
-            print('[!] Logged on as {0}!'.format(self.user))
-            await self.change_presence(activity=discord.Game("Minecraft: Java Edition"), status=discord.Status.online)
+            print(f"[!] Logged on as {self.user}!")
+            await self.change_presence(activity=self._PRESENCE, status=discord.Status.online)
 
         async def on_connect(self):
             print("[!] Connected to discord")
@@ -86,9 +95,13 @@ class MCLink:
         async def on_disconnect(self):
             print("[!] Lost connection to Discord")
 
+        async def on_member_update(self, before, after):
+            # Roles may have changed, so the cached permission level is no longer trustworthy
+            self._parent._perm_cache.pop(after.id, None)
+
         async def on_message(self, message):
             if self._DEBUG:
-                print('Message from {0.author}: {0.content}'.format(message))
+                print(f"Message from {message.author}: {message.content}")
 
             # Ignore messages from self, or other bots
             if (message.author == self.user) or message.author.bot:
@@ -99,21 +112,36 @@ class MCLink:
                     response = await self._parent.call(message.content[1:], message.author)
 
                     if response is not None:
-                        await message.channel.send(("[FAIL] " if not response[0] else "") + response[1])
+                        await message.channel.send(f"[FAIL] {response[1]}" if not response[0] else response[1])
 
-                except Exception as e:
-                    response = ":exclamation: An error occurred while trying to run the command '{:s}'.\nPlease notify the development team.\n\nException: {:s}".format(message.content[1:], str(e))
-                    print(response)
-                    traceback.print_tb(e.__traceback__)
-                    await message.channel.send(content=response)
+                except CommandUserError as e:
+                    await message.channel.send(f"[FAIL] {e}")
+
+                except Exception:
+                    _log.exception("An error occurred while trying to run the command '%s'", message.content[1:])
+                    await message.channel.send(content=":exclamation: An error occurred while trying to run that command.\nPlease notify the development team.")
 
     def __init__(self):
         super().__init__()
+
+        # Set of admins
+        self._bot_admins = set()  # type: Set[int]
+        self._commands = {}  # type: Dict[str, Command]
+        self._role_permissions = {}  # type: Dict[int, int]
+        self._role_permission_ids = set()  # type: Set[int]
+        self._output_channels = {}
+
+        # Cached permission levels, keyed by user id and ordered oldest first
+        self._perm_cache = OrderedDict()  # type: OrderedDict[int, Tuple[float, Permission]]
+
+        # Pre-built help messages, keyed by permission level
+        self._help_cache = {}  # type: Dict[int, str]
+
         self.register_command("help", Permission.Default, self.help, "Show this help menu")
 
     def connect(self, bot_token: str, guild_id: int, rcon_host: str, rcon_port: int, rcon_password: str):
         """
-        Open a connection to a Minecraft: Java Edition RCON
+        Open a connection to a Minecraft: Java Edition RCON and run the Discord bot. Blocks until the bot stops
         :param bot_token: Discord Bot token
         :param guild_id: Discord Server ID
         :param rcon_host: Host address
@@ -121,45 +149,68 @@ class MCLink:
         :param rcon_password: RCON password
         :return: Successful
         """
-        # Set parameters
+        self.setup(guild_id, rcon_host, rcon_port, rcon_password)
+        self.run(bot_token)
+
+    def setup(self, guild_id: int, rcon_host: str, rcon_port: int, rcon_password: str):
+        """
+        Set the Discord server and Minecraft: Java Edition RCON to link. The RCON connection is opened by run_async
+        :param guild_id: Discord Server ID
+        :param rcon_host: Host address
+        :param rcon_port: RCON port
+        :param rcon_password: RCON password
+        :return: None
+        """
         self._guild_id = guild_id
+        self._rcon_host = rcon_host
+        self._rcon_port = rcon_port
+        self._rcon_password = rcon_password
+
+    def run(self, bot_token: str):
+        """
+        Run the Discord bot on a new event loop. Blocks until the bot stops
+        :param bot_token: Discord Bot token
+        :return: None
+        """
+        asyncio.run(self.run_async(bot_token))
 
+    async def run_async(self, bot_token: str):
+        """
+        Connect to the RCON and run the Discord bot on the current event loop, allowing the caller to schedule other
+        tasks alongside it
+        :param bot_token: Discord Bot token
+        :return: None
+        """
         # Connect to RCON
-        self._rcon_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self._rcon_socket.connect((rcon_host, rcon_port))
-
-            # Log in
-            result = mcrcon.login(self._rcon_socket, rcon_password)
-            if not result:
-                print("Incorrect rcon password")
-                self.close()
-                raise ConnectionError("Incorrect rcon password")
-
+            self._rcon = await AsyncRcon.connect(self._rcon_host, self._rcon_port, self._rcon_password)
         except Exception as e:
             print("Failed to connect to the Minecraft RCON server")
             print(e)
-            self.close()
             raise e
 
         # Connect to discord
         self._link = self._DiscordLink(self)
-        self._link.run(bot_token)
+        try:
+            async with self._link:
+                await self._link.start(bot_token)
+        finally:
+            self.close()
 
     def close(self):
         """
         Closes the RCON connection
         :return: None
         """
-        if self.is_connected():
-            self._rcon_socket.close()
-            self._rcon_socket = None
+        if self._rcon is not None:
+            self._rcon.close()
+            self._rcon = None
 
     def is_connected(self):
         """
         :return: Whether the RCON connection is open
         """
-        return self._rcon_socket is not None
+        return self._rcon is not None and self._rcon.is_open()
 
     def log(self, message: str):
         print(message)
@@ -170,7 +221,7 @@ class MCLink:
         :param user_id: Discord UserID
         :return:
         """
-        self._bot_admins.append(user_id)
+        self._bot_admins.add(user_id)
 
     def register_role(self, role_id: int, level: Permission):
         """
@@ -179,7 +230,9 @@ class MCLink:
         :param level: Permission level this role grants for commands
         :return:
         """
-        self._role_permissions[role_id] = level
+        self._role_permissions[role_id] = level.value
+        self._role_permission_ids.add(role_id)
+        self._perm_cache.clear()
 
     def register_command(self, name: str, level: Permission, func: Callable, help: str = ""):
         """
@@ -188,34 +241,67 @@ class MCLink:
         :param level: Permission level required to run this command
         :param func: Function to execute. MUST take these parameters:
             <Minecraft Execute Handle>: Callable[str], <Arguments List>: List[str], <Discord Member>: discord.Member
+            Raise CommandUserError to report bad input back to the user
         :return:
         """
         self._commands[name] = Command(name, level, func, help)
+        self._help_cache.clear()
 
-    def get_member_permission_level(self, user: discord.User) -> Permission:
+    async def get_member_permission_level(self, user: discord.User) -> Permission:
         """
         Get the permission level for a given member
         :param member: MemberId
         :return: Permission level
         """
+        # Reuse a recently computed result
+        cached = self._perm_cache.get(user.id)
+        if cached is not None and time.monotonic() - cached[0] < self._PERMISSION_CACHE_TTL:
+            return cached[1]
+
         guild = self._link.get_guild(self._guild_id)  # type: discord.Guild
 
-        # Get the member object for this user
-        try:
-            member_index = guild.members.index(user)  # type: discord.Member
-            member = guild.members[member_index]
-        except ValueError:
-            return Permission.Default
-
-        # Go through their roles and find their highest level permission
-        permission_level: Permission = Permission.Default
-        role: discord.Role
-        for role in member.roles:
-            if role in self._role_permissions:
-                permission_level = max(permission_level, self._role_permissions[role.id])
+        # Get the member object for this user, falling back to the API if they aren't cached
+        member = guild.get_member(user.id)  # type: discord.Member
+        if member is None:
+            try:
+                member = await guild.fetch_member(user.id)
+            except discord.HTTPException:
+                # Not a member, or we can't look them up (NotFound and Forbidden are both HTTPExceptions). Cache the
+                # result anyway so repeated commands from them don't each cost an API request
+                self._cache_permission_level(user.id, Permission.Default)
+                return Permission.Default
+
+        # Find which of their roles grant a permission level, and take the highest
+        matched = self._role_permission_ids.intersection(r.id for r in member.roles)
+        if matched:
+            permission_level = Permission(max(self._role_permissions[rid] for rid in matched))
+        else:
+            permission_level = Permission.Default
 
+        self._cache_permission_level(user.id, permission_level)
         return permission_level
 
+    def _cache_permission_level(self, user_id: int, level: Permission):
+        """
+        Cache a member's permission level, evicting expired entries and keeping the cache within its size limit
+        :param user_id: Discord UserID
+        :param level: Permission level to cache
+        :return:
+        """
+        now = time.monotonic()
+        cache = self._perm_cache
+
+        # Re-insert rather than update, so the cache stays in the order entries were added, which is also the order
+        # they expire in
+        cache.pop(user_id, None)
+        cache[user_id] = (now, level)
+
+        while cache:
+            timestamp, _ = next(iter(cache.values()))
+            if len(cache) <= self._PERMISSION_CACHE_SIZE and now - timestamp < self._PERMISSION_CACHE_TTL:
+                break
+            cache.popitem(last=False)
+
     async def call(self, input: str, user: discord.User) -> Tuple[bool, str]:
         """
         Call a command
@@ -223,24 +309,22 @@ class MCLink:
         :param member: Member who is running this command
         :return: Tuple[Success, Response Message]
         """
-        cmd_args = input.split(" ")
-        cmd_name = cmd_args[0]  # type: str
-        cmd_args = cmd_args[1:]  # type: List[str]
+        cmd_name, sep, rest = input.partition(" ")
 
         # Get the command object
-        try:
-            cmd = self._commands[cmd_name]  # type: Command
-        except KeyError:
-            return False, "Error: Unknown command '{:s}'".format(cmd_name)
+        cmd = self._commands.get(cmd_name)  # type: Command
+        if cmd is None:
+            return False, f"Error: Unknown command '{cmd_name}'"
 
-        # Check the user has permission to run the command
-        if self.get_member_permission_level(user) < cmd.permission:
+        # Check the user has permission to run the command. Everyone may run Default commands, so skip the lookup
+        if cmd.permission.value > 0 and (await self.get_member_permission_level(user)).value < cmd.permission.value:
             return False, "You don't have permission for that command."
 
         # Run the command
         else:
+            cmd_args = rest.split(" ") if sep else []  # type: List[str]
             if self._DEBUG:
-                self.log("Running '{:s}'".format(input))
+                self.log(f"Running '{input}'")
             response = await cmd.func(link=self, args=cmd_args, user=user)
 
             if response is None:
@@ -258,10 +342,7 @@ class MCLink:
         if not self.is_connected():
             return "RCON is not connected"
 
-        async def run_command():
-            return mcrcon.command(self._rcon_socket, command)
-
-        return await run_command()
+        return await self._rcon.command(command)
 
     async def help(self, link: "MCLink", args: List[str], user: discord.User):
         """
@@ -271,11 +352,14 @@ class MCLink:
         :param user:
         :return:
         """
-        message = "Hello! I am a Discord -> Minecraft: Java Edition server link!\nHere are the commands available to you:\n\n"
-        user_permission = self.get_member_permission_level(user)
-
-        for x in self._commands.values():
-            if user_permission >= x.permission:
-                message += "* `{:s}` - {:s}\n".format(x.name, x.help)
+        user_permission = (await self.get_member_permission_level(user)).value
+
+        message = self._help_cache.get(user_permission)
+        if message is None:
+            parts = ["Hello! I am a Discord -> Minecraft: Java Edition server link!\nHere are the commands available to you:\n\n"]
+            parts.extend(f"* `{x.name}` - {x.help}\n"
+                         for x in self._commands.values() if user_permission >= x.permission.value)
+            message = "".join(parts)
+            self._help_cache[user_permission] = message
 
         return True, message
@@ -0,0 +1,166 @@
+# coding=utf-8
+import asyncio
+import struct
+import unittest
+from unittest import mock
+
+from async_rcon import AsyncRcon
+
+PASSWORD = "hunter2"
+
+
+def pack(request_id: int, packet_type: int, body: bytes) -> bytes:
+    payload = struct.pack("<ii", request_id, packet_type) + body + b"\x00\x00"
+    return struct.pack("<i", len(payload)) + payload
+
+
+class FakeServer:
+    """
+    Behaves like the vanilla server: each packet is read with a single socket read, and the connection is dropped if
+    that read doesn't hold exactly one packet. Long responses are split into 4096 character packets
+    """
+
+    def __init__(self, respond_to_login=True):
+        self.respond_to_login = respond_to_login
+        self.hang_up_on_command = False
+        self.malformed_response = False
+        self.dropped = False
+        self.writers = []
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for writer in self.writers:
+            writer.close()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def respond(self, command: str) -> str:
+        if command == "long":
+            return "a" * 4096 + "b" * 4096 + "c"
+        if command == "full":
+            return "a" * 4096
+        return "echo " + command
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writers.append(writer)
+        try:
+            while True:
+                data = await reader.read(1460)
+                if not data:
+                    return
+
+                length, = struct.unpack("<i", data[:4])
+                if length != len(data) - 4:
+                    self.dropped = True
+                    return
+
+                request_id, packet_type = struct.unpack("<ii", data[4:12])
+                body = data[12:-2].decode("utf8")
+
+                if packet_type == 3:
+                    if not self.respond_to_login:
+                        continue
+                    writer.write(pack(request_id if body == PASSWORD else -1, 2, b""))
+                elif packet_type == 2:
+                    if self.hang_up_on_command:
+                        return
+                    if self.malformed_response:
+                        writer.write(struct.pack("<i", -5))
+                        await writer.drain()
+                        continue
+
+                    response = self.respond(body)
+                    for i in range(0, len(response), 4096):
+                        writer.write(pack(request_id, 0, response[i:i + 4096].encode("utf8")))
+                else:
+                    writer.write(pack(request_id, 0, "Unknown request {:x}".format(packet_type).encode("utf8")))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+class AsyncRconTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = FakeServer()
+        self.port = await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    async def connect(self) -> AsyncRcon:
+        rcon = await AsyncRcon.connect("127.0.0.1", self.port, PASSWORD)
+        self.addCleanup(rcon.close)
+        return rcon
+
+    async def test_login(self):
+        rcon = await self.connect()
+        self.assertTrue(rcon.is_open())
+
+    async def test_login_wrong_password(self):
+        with self.assertRaisesRegex(ConnectionError, "Incorrect rcon password"):
+            await AsyncRcon.connect("127.0.0.1", self.port, "wrong")
+
+    async def test_login_timeout(self):
+        self.server.respond_to_login = False
+        with mock.patch.object(AsyncRcon, "_LOGIN_TIMEOUT", 0.1):
+            with self.assertRaisesRegex(ConnectionError, "Timed out"):
+                await AsyncRcon.connect("127.0.0.1", self.port, PASSWORD)
+
+    async def test_command(self):
+        rcon = await self.connect()
+        self.assertEqual(await rcon.command("list"), "echo list")
+
+    async def test_split_response(self):
+        rcon = await self.connect()
+        self.assertEqual(await rcon.command("long"), "a" * 4096 + "b" * 4096 + "c")
+        self.assertEqual(await rcon.command("list"), "echo list")
+
+    async def test_response_filling_one_packet(self):
+        rcon = await self.connect()
+        self.assertEqual(await rcon.command("full"), "a" * 4096)
+        self.assertEqual(await rcon.command("list"), "echo list")
+
+    async def test_concurrent_commands(self):
+        rcon = await self.connect()
+        responses = await asyncio.gather(*(rcon.command(f"cmd{i}") for i in range(5)), rcon.command("long"))
+
+        self.assertEqual(responses[:5], [f"echo cmd{i}" for i in range(5)])
+        self.assertEqual(len(responses[5]), 4096 * 2 + 1)
+        self.assertFalse(self.server.dropped)
+        self.assertTrue(rcon.is_open())
+
+    async def test_malformed_length(self):
+        rcon = await self.connect()
+        self.server.malformed_response = True
+
+        with self.assertLogs("async_rcon", "ERROR"):
+            with self.assertRaises(ConnectionError):
+                await rcon.command("list")
+        self.assertFalse(rcon.is_open())
+
+    async def test_connection_lost_while_waiting(self):
+        rcon = await self.connect()
+        self.server.hang_up_on_command = True
+
+        results = await asyncio.gather(rcon.command("a"), rcon.command("b"), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertFalse(rcon.is_open())
+
+    async def test_command_after_close(self):
+        rcon = await self.connect()
+        rcon.close()
+        await asyncio.sleep(0)
+
+        with self.assertRaises(ConnectionError):
+            await rcon.command("list")
+
+
+if __name__ == "__main__":
+    unittest.main()